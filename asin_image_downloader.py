@@ -1,12 +1,25 @@
+import functools
+import hashlib
 import math
 import os
 import re
-from typing import Dict, List, Optional, Tuple
-from zipfile import ZipFile, ZIP_DEFLATED
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager, suppress
+from io import BytesIO
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
 import pandas as pd
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ------------------------------
 # Streamlit Setup
@@ -19,6 +32,82 @@ st.title("Sitruna ASIN Image Downloader")
 # ------------------------------
 OUTPUT_DIR = "zip_output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Batch results are cached this long; per-batch directories under OUTPUT_DIR
+# that nobody has touched for as long are deleted.
+BATCH_TTL = 3600
+
+# Bodies of images served with an ETag / Last-Modified are kept here so later
+# runs can revalidate them with a conditional GET instead of re-downloading.
+# Almost every CDN sends one of the two, so most bodies are written here.
+CACHE_DIR = "image_cache"
+ETAG_DB = os.path.join(CACHE_DIR, "etag_cache.sqlite")
+# Least recently used bodies are evicted once the cache grows past this.
+IMAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# Downloads are network-bound, so fetch many images at once per batch.
+# The connection pool is sized so every worker can keep its own socket alive.
+MAX_WORKERS = 32
+POOL_SIZE = 64
+# Cap in-flight requests per host so a single CDN is not hammered into
+# throttling us (429/503s that only show up as errors in the report).
+MAX_PER_HOST = 16
+
+# Image bodies are streamed in chunks, and anything over the cap is rejected
+# outright. Bodies with validators are written straight to CACHE_DIR. Only the
+# rest use a spool, which stays in memory up to SPOOL_MAX_BYTES and then
+# spills to a temp file.
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 2 * 1024 * 1024
+MAX_IMAGE_BYTES = 50 * 1024 * 1024
+
+# Large runs produce thousands of report rows; only failures are rendered by
+# default, and at most this many of them.
+REPORT_PREVIEW_ROWS = 200
+
+# These formats are already entropy-coded; deflating them burns CPU for
+# next to no size reduction, so they are stored as-is.
+PRECOMPRESSED_EXTS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".webp"})
+# The formats that are still deflated (BMP, TIFF) shrink well even at the
+# fastest zlib level, so don't pay for level 6.
+DEFLATE_LEVEL = 1
+# Entries get a fixed timestamp and mode, so there is no localtime() call per
+# file. Together with writing entries in task order (see build_zip_for_batch),
+# the same downloaded images always produce byte-identical archives.
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+ZIP_FILE_MODE = 0o644 << 16
+
+# ------------------------------
+# HTTP Session
+# ------------------------------
+# One pooled session for the whole app: image CDNs serve from a handful of
+# hosts, so keep-alive saves a TCP + TLS handshake on almost every image.
+# Cached as a resource so the pool survives Streamlit reruns.
+@st.cache_resource
+def get_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update(
+        {
+            "User-Agent": "ASIN-Image-Downloader/1.0",
+            "Accept": "image/*,*/*;q=0.8",
+        }
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_SIZE,
+        pool_maxsize=POOL_SIZE,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = get_session()
 
 # ------------------------------
 # Session State
@@ -39,64 +128,283 @@ ZIPs are written to disk to ensure **stable downloads without crashing**.
 # ------------------------------
 # Helpers
 # ------------------------------
-def is_valid_url(url: object) -> bool:
-    if url is None:
-        return False
-    s = str(url).strip().lower()
-    if s in {"", "nan", "none", "null", "na", "true", "false"}:
-        return False
-    return s.startswith("http://") or s.startswith("https://")
+_URL_PREFIX = r"\s*https?://"
+_QUERY_RE = re.compile(r"[?#].*$")
+_EXT_RE = re.compile(r"\.(jpe?g|png|gif|webp|bmp|tiff?)$", re.I)
+_CT_TO_EXT = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp",
+    "image/tiff": ".tif",
+}
+
+
+def _column_url_mask(s: pd.Series) -> pd.Series:
+    if not (pd.api.types.is_object_dtype(s.dtype) or pd.api.types.is_string_dtype(s.dtype)):
+        # Numeric (including all-NaN) columns can't hold URLs.
+        return pd.Series(False, index=s.index)
+    try:
+        # Non-string cells in object columns come back as NA -> False.
+        return s.str.match(_URL_PREFIX, case=False, na=False).astype(bool)
+    except AttributeError:
+        # Object column holding no strings at all (e.g. only ints or bools).
+        return pd.Series(False, index=s.index)
+
+
+def valid_url_mask(frame: pd.DataFrame) -> pd.DataFrame:
+    # True where a cell is a string starting with http:// or https:// (leading
+    # whitespace and case ignored). Junk sentinels like "nan" never match.
+    return frame.apply(_column_url_mask)
 
 
 def infer_ext(url: str, content_type: Optional[str]) -> str:
-    path = re.sub(r"[?#].*$", "", url)
-    m = re.search(r"\.(jpe?g|png|gif|webp|bmp|tiff?)$", path, re.I)
+    path = _QUERY_RE.sub("", url)
+    m = _EXT_RE.search(path)
     if m:
         return "." + m.group(1).lower()
 
     if content_type:
-        mapping = {
-            "image/jpeg": ".jpg",
-            "image/jpg": ".jpg",
-            "image/png": ".png",
-            "image/gif": ".gif",
-            "image/webp": ".webp",
-            "image/bmp": ".bmp",
-            "image/tiff": ".tif",
-        }
         ct = content_type.split(";")[0].lower()
-        return mapping.get(ct, ".jpg")
+        return _CT_TO_EXT.get(ct, ".jpg")
 
     return ".jpg"
 
 
-def suffix_for_column(col: str, pt_counter: int) -> Tuple[str, int]:
+@functools.lru_cache(maxsize=None)
+def classify_column(col: str) -> str:
     c = col.strip().lower().replace("_", " ")
     c_words = set(c.split())
 
     if "swatch" in c:
-        return "Swatch", pt_counter
+        return "Swatch"
 
     if c in {"main image", "image main"} or ({"main", "image"} <= c_words):
-        return "Main", pt_counter
+        return "Main"
+
+    return "PT"
+
+
+def zip_entry(filename: str, ext: str, size: int) -> ZipInfo:
+    # Entries are written with ZipFile.open("w"), which computes the CRC in the
+    # same pass as the copy. Declaring the size up front lets zipfile pick
+    # Zip64 only when an entry actually needs it.
+    zinfo = ZipInfo(filename, date_time=ZIP_EPOCH)
+    zinfo.external_attr = ZIP_FILE_MODE
+    zinfo.file_size = size
+    if ext in PRECOMPRESSED_EXTS:
+        zinfo.compress_type = ZIP_STORED
+    else:
+        zinfo.compress_type = ZIP_DEFLATED
+        # ZipFile(compresslevel=...) is not applied to caller-built ZipInfos.
+        # Python 3.13 made the attribute public; older versions only have the
+        # private name.
+        if hasattr(zinfo, "compress_level"):
+            zinfo.compress_level = DEFLATE_LEVEL
+        else:
+            zinfo._compresslevel = DEFLATE_LEVEL
+    return zinfo
 
-    return f"PT{pt_counter:02d}", pt_counter + 1
 
+# Cached as a resource like the session, so the per-host cap holds across
+# reruns and across every session of the app, not just within one run.
+@st.cache_resource
+def get_host_slots() -> Tuple[Dict[str, threading.BoundedSemaphore], threading.Lock]:
+    return {}, threading.Lock()
 
-def download_bytes(url: str, timeout: float) -> Tuple[Optional[bytes], Optional[str], Optional[int], Optional[str]]:
-    headers = {
-        "User-Agent": "ASIN-Image-Downloader/1.0",
-        "Accept": "image/*,*/*;q=0.8",
-    }
+
+_host_slots, _host_slots_lock = get_host_slots()
+
+
+def host_slot(url: str) -> threading.BoundedSemaphore:
+    try:
+        host = urlsplit(url).netloc.lower()
+    except ValueError:
+        # Malformed URLs still go through requests, which reports the error.
+        host = ""
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+
+# (etag, last_modified, content_type) remembered for a URL.
+Validators = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def open_etag_store() -> sqlite3.Connection:
+    store = sqlite3.connect(ETAG_DB)
+    store.execute(
+        "CREATE TABLE IF NOT EXISTS etags "
+        "(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_type TEXT)"
+    )
+    return store
+
+
+def cache_path(url: str) -> str:
+    return os.path.join(CACHE_DIR, hashlib.sha1(url.encode()).hexdigest())
+
+
+def prune_image_cache(max_bytes: int = IMAGE_CACHE_MAX_BYTES) -> None:
+    # Only the SHA-1 named bodies count; the store and in-flight temp files don't.
+    entries = []
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and len(entry.name) == 40:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+
+    # Oldest first; a 304 refreshes a body's mtime, so this is LRU.
+    # Orphaned rows in the store are harmless: the conditional headers are
+    # only sent when the body file still exists.
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def prune_output_dir(keep: List[str], max_age: float = BATCH_TTL) -> None:
+    # Sessions touch the directories they still offer for download on every
+    # rerun, so only abandoned ones age out.
+    cutoff = time.time() - max_age
+    keep = {os.path.abspath(path) for path in keep}
+    with os.scandir(OUTPUT_DIR) as it:
+        for entry in it:
+            if not entry.is_dir() or os.path.abspath(entry.path) in keep:
+                continue
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def touch_dirs(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.utime(os.path.dirname(path))
+        except OSError:
+            pass
+
+
+def copy_body(r: requests.Response, dest: IO[bytes]) -> Optional[int]:
+    # Returns the number of bytes copied, or None once MAX_IMAGE_BYTES is exceeded.
+    size = 0
+    for chunk in r.iter_content(CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_IMAGE_BYTES:
+            return None
+        dest.write(chunk)
+    return size
+
+
+# (body, content_type, status, error, validators to remember)
+DownloadResult = Tuple[Optional[IO[bytes]], Optional[str], Optional[int], Optional[str], Optional[Validators]]
+
+
+def download_to_file(url: str, timeout: float, prior: Optional[Validators] = None) -> DownloadResult:
+    headers: Dict[str, str] = {}
+    path = cache_path(url)
+    if prior and os.path.exists(path):
+        etag, last_modified, _ = prior
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    else:
+        prior = None
+
+    content_type: Optional[str] = None
+    status: Optional[int] = None
     try:
-        r = requests.get(url, timeout=timeout, headers=headers)
-        if 200 <= r.status_code < 300 and r.content:
-            return r.content, r.headers.get("Content-Type"), r.status_code, None
-        return None, r.headers.get("Content-Type"), r.status_code, f"HTTP {r.status_code}"
+        with host_slot(url), _session.get(url, timeout=timeout, headers=headers, stream=True) as r:
+            status = r.status_code
+            if r.status_code == 304 and prior:
+                try:
+                    os.utime(path)
+                    return open(path, "rb"), prior[2], r.status_code, None, None
+                except OSError as e:
+                    return None, prior[2], r.status_code, str(e), None
+
+            content_type = r.headers.get("Content-Type")
+            if not 200 <= r.status_code < 300:
+                return None, content_type, r.status_code, f"HTTP {r.status_code}", None
+
+            length = r.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > MAX_IMAGE_BYTES:
+                return None, content_type, r.status_code, "too large", None
+
+            # Revalidatable bodies (most CDN responses) go straight into the
+            # on-disk cache; the rest are spooled and thrown away once written
+            # to the ZIP.
+            etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+            keep = bool(etag or last_modified)
+            if keep:
+                buf = tempfile.NamedTemporaryFile(dir=CACHE_DIR, delete=False)
+            else:
+                buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+
+            size = None
+            try:
+                size = copy_body(r, buf)
+            finally:
+                if keep or not size:
+                    buf.close()
+                if keep and not size:
+                    os.remove(buf.name)
+
+            if not size:
+                err = "too large" if size is None else f"HTTP {r.status_code}"
+                return None, content_type, r.status_code, err, None
+
+            if keep:
+                try:
+                    os.replace(buf.name, path)
+                except OSError:
+                    with suppress(OSError):
+                        os.remove(buf.name)
+                    raise
+                return open(path, "rb"), content_type, r.status_code, None, (etag, last_modified, content_type)
+
+            buf.seek(0)
+            return buf, content_type, r.status_code, None, None
     except requests.Timeout:
-        return None, None, None, "timeout"
+        return None, None, None, "timeout", None
     except requests.RequestException as e:
-        return None, None, None, str(e)
+        return None, None, None, str(e), None
+    except OSError as e:
+        # Local failures (disk full, too many open files, permissions) fail
+        # this image only, like any other download error.
+        return None, content_type, status, str(e), None
+
+
+@contextmanager
+def replacing(path: str) -> Iterator[str]:
+    # Yields a temp path next to `path` and renames it over `path` on success.
+    # ZIPs live at shared paths, so they are never truncated in place while
+    # another session may be serving or copying from them.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+# (zip_path, entry index, status) of the first ZIP entry written for a URL.
+# Indexed rather than named: two columns of the same kind on one ASIN (e.g.
+# two swatches) produce duplicate member names within a ZIP.
+CachedEntry = Tuple[str, int, Optional[int]]
 
 
 def build_zip_for_batch(
@@ -105,41 +413,257 @@ def build_zip_for_batch(
     image_columns: List[str],
     zip_path: str,
     per_request_timeout: float,
+    max_workers: int = MAX_WORKERS,
+    url_cache: Optional[Dict[str, CachedEntry]] = None,
 ) -> Tuple[Dict[str, int], List[Dict[str, object]]]:
 
-    events: List[Dict[str, object]] = []
     files_written = 0
     errors = 0
 
-    with ZipFile(zip_path, "w", ZIP_DEFLATED) as zipf:
-        for _, row in batch_df.iterrows():
-            asin = str(row[asin_col]).strip()
-            pt_counter = 1
-
-            for col in image_columns:
-                raw_url = row.get(col)
-                if not is_valid_url(raw_url):
+    # Column names are constant and validity is checked for the whole batch at
+    # once, so the per-cell work below is just lookups.
+    col_kinds = [classify_column(col) for col in image_columns]
+    url_mask = valid_url_mask(batch_df[image_columns]).to_numpy()
+
+    # Resolve filenames up front in input order so PTxx numbering is
+    # deterministic no matter which download finishes first.
+    asins = batch_df[asin_col].astype(str).str.strip().to_numpy()
+    urls = batch_df[image_columns].to_numpy(dtype=object)
+
+    tasks: List[Tuple[str, str, str, str]] = []
+    for i, asin in enumerate(asins):
+        pt_counter = 1
+
+        for j, col in enumerate(image_columns):
+            if not url_mask[i, j]:
+                continue
+
+            if col_kinds[j] == "PT":
+                suffix = f"PT{pt_counter:02d}"
+                pt_counter += 1
+            else:
+                suffix = col_kinds[j]
+            tasks.append((asin, col, suffix, str(urls[i, j])))
+
+    # URLs already fetched by an earlier batch map to a CachedEntry and are
+    # copied out of that ZIP instead of being downloaded again.
+    # Everything else is fetched once per distinct URL, then fanned out to every
+    # task that uses it (shared swatches, parent/child variants, ...).
+    if url_cache is None:
+        url_cache = {}
+    pending: Dict[str, List[int]] = {}
+    for i, (_, _, _, url) in enumerate(tasks):
+        if url not in url_cache:
+            pending.setdefault(url, []).append(i)
+
+    # ZipFile is not thread-safe: workers only download, the main thread writes.
+    events: List[Optional[Dict[str, object]]] = [None] * len(tasks)
+    with ExitStack() as stack:
+        # Entered first so the rename happens only after the ZIP is closed.
+        tmp_path = stack.enter_context(replacing(zip_path))
+        store = stack.enter_context(closing(open_etag_store()))
+        priors: Dict[str, Validators] = {}
+        for url in pending:
+            row = store.execute(
+                "SELECT etag, last_modified, content_type FROM etags WHERE url = ?", (url,)
+            ).fetchone()
+            if row:
+                priors[url] = row
+
+        zipf = stack.enter_context(ZipFile(tmp_path, "w"))
+        ex = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+
+        # Entries are written in task order, not completion order, so the same
+        # inputs give the same member order and central directory every run.
+        # Every finished download holds an open body until it is written, so
+        # URLs are submitted in first-use order and at most `window` of them
+        # run ahead of the writer.
+        window = 2 * max_workers
+        queued = iter(pending)
+        futures: Dict[str, Future] = {}
+
+        def submit_next() -> None:
+            url = next(queued, None)
+            if url is not None:
+                futures[url] = ex.submit(download_to_file, url, per_request_timeout, priors.get(url))
+
+        fresh: List[Tuple[str, Optional[str], Optional[str], Optional[str]]] = []
+        sources: Dict[str, ZipFile] = {}
+        results: Dict[str, DownloadResult] = {}
+
+        def close_bodies() -> None:
+            # Bodies are closed after their last use; this catches any left
+            # open when the batch is aborted part way.
+            ex.shutdown(cancel_futures=True)
+            done = [f.result() for f in futures.values() if not f.cancelled() and f.exception() is None]
+            for body, *_ in done + list(results.values()):
+                if body is not None:
+                    body.close()
+
+        stack.callback(close_bodies)
+        for _ in range(window):
+            submit_next()
+        remaining = {url: len(indices) for url, indices in pending.items()}
+        for i, (asin, col, suffix, url) in enumerate(tasks):
+            if url in pending:
+                if url not in results:
+                    results[url] = futures.pop(url).result()
+                    submit_next()
+                    if results[url][4]:
+                        fresh.append((url, *results[url][4]))
+                body, content_type, status, err, _ = results[url]
+                remaining[url] -= 1
+
+                if body is None:
+                    errors += 1
+                    events[i] = {"ASIN": asin, "Column": col, "Saved As": None, "Status": status, "Error": err}
                     continue
 
-                suffix, pt_counter = suffix_for_column(col, pt_counter)
-                content, content_type, status, err = download_bytes(str(raw_url), per_request_timeout)
-
-                if content:
-                    ext = infer_ext(str(raw_url), content_type)
-                    filename = f"{asin}.{suffix}{ext}"
-                    zipf.writestr(filename, content)
-                    files_written += 1
-                    events.append(
-                        {"ASIN": asin, "Column": col, "Saved As": filename, "Status": status, "Error": None}
-                    )
-                else:
-                    errors += 1
-                    events.append(
-                        {"ASIN": asin, "Column": col, "Saved As": None, "Status": status, "Error": err}
-                    )
+                ext = infer_ext(url, content_type)
+                filename = f"{asin}.{suffix}{ext}"
+                size = body.seek(0, os.SEEK_END)
+                body.seek(0)
+                url_cache.setdefault(url, (zip_path, len(zipf.infolist()), status))
+                with zipf.open(zip_entry(filename, ext, size), "w") as dest:
+                    shutil.copyfileobj(body, dest, CHUNK_SIZE)
+                if not remaining[url]:
+                    body.close()
+            else:
+                src_path, index, status = url_cache[url]
+                if src_path not in sources:
+                    sources[src_path] = stack.enter_context(ZipFile(src_path))
+                member = sources[src_path].infolist()[index]
+
+                ext = os.path.splitext(member.filename)[1]
+                filename = f"{asin}.{suffix}{ext}"
+                zinfo = zip_entry(filename, ext, member.file_size)
+                with sources[src_path].open(member) as body, zipf.open(zinfo, "w") as dest:
+                    shutil.copyfileobj(body, dest, CHUNK_SIZE)
+
+            files_written += 1
+            events[i] = {"ASIN": asin, "Column": col, "Saved As": filename, "Status": status, "Error": None}
+
+        with store:
+            store.executemany("INSERT OR REPLACE INTO etags VALUES (?, ?, ?, ?)", fresh)
 
     counters = {"files_written": files_written, "asins": len(batch_df), "errors": errors}
-    return counters, events
+    # Every task fills its slot; the filter only narrows the type.
+    return counters, [event for event in events if event is not None]
+
+
+def merge_batch_zips(zip_paths: List[str], out_path: str) -> None:
+    # Entries are streamed member by member; stored images are a plain copy.
+    with ZipFile(out_path, "w") as dst:
+        for path in zip_paths:
+            with ZipFile(path) as src:
+                for info in src.infolist():
+                    zinfo = zip_entry(info.filename, os.path.splitext(info.filename)[1], info.file_size)
+                    with src.open(info) as body, dst.open(zinfo, "w") as dest:
+                        shutil.copyfileobj(body, dest, CHUNK_SIZE)
+
+
+def combined_zip_path(zip_paths: List[str]) -> str:
+    # Batch paths only identify the input rows, and a batch with errors is
+    # rebuilt in place, so each file's size and mtime are part of the key too.
+    # Raises FileNotFoundError once any batch has been pruned.
+    h = hashlib.sha1()
+    for path in zip_paths:
+        stat = os.stat(path)
+        h.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    digest = h.hexdigest()[:16]
+    return os.path.join(OUTPUT_DIR, digest, "asin_batches_all.zip")
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def combined_zip(zip_paths: List[str]) -> bytes:
+    # Runs only when the download is clicked. An archive already merged by an
+    # earlier click (or another session) is served as-is.
+    out_path = combined_zip_path(zip_paths)
+    if not os.path.exists(out_path):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with replacing(out_path) as tmp_path:
+            merge_batch_zips(zip_paths, tmp_path)
+    return read_file(out_path)
+
+
+def batch_digest(batch_df: pd.DataFrame, *params: object) -> str:
+    h = hashlib.sha1(repr((list(batch_df.columns), params)).encode())
+    h.update(pd.util.hash_pandas_object(batch_df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class _UncachedBatch(Exception):
+    # Raised out of _cached_batch so st.cache_data does not store the result.
+    def __init__(self, result: Tuple[Dict[str, int], List[Dict[str, object]]]):
+        super().__init__()
+        self.result = result
+
+
+# Reruns with the same rows and settings reuse the ZIP already on disk. The
+# ZIP path is content-addressed (see batch_digest), so a cached entry always
+# points at the bytes it describes. _max_workers only affects speed and
+# _url_cache is per run, so both are excluded from the cache key.
+@st.cache_data(show_spinner=False, max_entries=256, ttl=BATCH_TTL)
+def _cached_batch(
+    batch_df: pd.DataFrame,
+    asin_col: str,
+    image_columns: Tuple[str, ...],
+    zip_path: str,
+    per_request_timeout: float,
+    _max_workers: int,
+    _url_cache: Dict[str, CachedEntry],
+) -> Tuple[Dict[str, int], List[Dict[str, object]]]:
+    result = build_zip_for_batch(
+        batch_df, asin_col, list(image_columns), zip_path, per_request_timeout, _max_workers, _url_cache
+    )
+    if result[0]["errors"]:
+        raise _UncachedBatch(result)
+    return result
+
+
+def cached_batch(*args: object) -> Tuple[Dict[str, int], List[Dict[str, object]]]:
+    # Timeouts and HTTP errors are often transient, so a batch with any
+    # errors is rebuilt on the next run instead of being served from cache.
+    try:
+        return _cached_batch(*args)
+    except _UncachedBatch as e:
+        return e.result
+
+
+def read_upload(data: bytes, name: str) -> pd.DataFrame:
+    # Prefer the native Arrow / Calamine parsers; fall back to pandas' default
+    # engines when those optional packages are not installed.
+    is_excel = name.endswith(".xlsx")
+    try:
+        if is_excel:
+            return pd.read_excel(BytesIO(data), engine="calamine")
+        return pd.read_csv(BytesIO(data), engine="pyarrow")
+    except (ImportError, ValueError):
+        return pd.read_excel(BytesIO(data)) if is_excel else pd.read_csv(BytesIO(data))
+
+
+# Every widget change reruns the script; parse each distinct upload only once.
+# _data is excluded from hashing since the digest already identifies it.
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_upload(digest: str, name: str, _data: bytes) -> pd.DataFrame:
+    return read_upload(_data, name)
+
+
+# Keyed on the upload digest too, so reruns skip both re-hashing the frame and
+# the dedup itself until the column selection changes.
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_asin_rows(
+    digest: str, name: str, asin_col: str, image_columns: Tuple[str, ...], _data: bytes
+) -> pd.DataFrame:
+    df = load_upload(digest, name, _data)
+    # Only the ASIN and image columns are needed from here on; dropping the
+    # rest before dedup keeps wide sheets cheap.
+    df = df[[asin_col] + [c for c in image_columns if c != asin_col]]
+    return df.dropna(subset=[asin_col]).drop_duplicates(subset=[asin_col], keep="first").reset_index(drop=True)
 
 
 # ------------------------------
@@ -149,7 +673,10 @@ uploaded_file = st.file_uploader("Upload your file", type=["xlsx", "csv"])
 
 if uploaded_file:
     try:
-        df = pd.read_excel(uploaded_file) if uploaded_file.name.endswith(".xlsx") else pd.read_csv(uploaded_file)
+        data = uploaded_file.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        with st.spinner("Reading file"):
+            df = load_upload(digest, uploaded_file.name, data)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         st.stop()
@@ -157,7 +684,6 @@ if uploaded_file:
     st.dataframe(df.head())
 
     asin_col = st.selectbox("Select ASIN Column", df.columns)
-    df = df.groupby(asin_col, as_index=False).first()
 
     image_columns = st.multiselect(
         "Choose image URL columns",
@@ -165,26 +691,46 @@ if uploaded_file:
         default=[c for c in df.columns if re.search(r"(image|img|swatch|main)", c, re.I)],
     )
 
+    df = load_asin_rows(digest, uploaded_file.name, asin_col, tuple(image_columns), data)
+
     batch_size = st.number_input("Batch size", 1, 200, 40)
     timeout_each = st.slider("Per-image timeout (seconds)", 4, 30, 12)
+    workers = st.slider(
+        "Parallel downloads",
+        1,
+        POOL_SIZE,
+        MAX_WORKERS,
+        help=(
+            f"At most {MAX_PER_HOST} requests go to any one image host at a time, shared across all users "
+            f"of the app. Values above {MAX_PER_HOST} only help sheets that mix several hosts."
+        ),
+    )
 
     if st.button("Generate ZIP Batches") and st.session_state.batches is None:
         num_batches = math.ceil(len(df) / batch_size)
         all_events = []
         batches = []
+        url_cache: Dict[str, CachedEntry] = {}
 
         for i in range(num_batches):
             batch_df = df.iloc[i * batch_size : (i + 1) * batch_size]
             zip_name = f"asin_batch_{i+1:02d}_of_{num_batches:02d}.zip"
-            zip_path = os.path.join(OUTPUT_DIR, zip_name)
+            batch_dir = os.path.join(OUTPUT_DIR, batch_digest(batch_df, asin_col, timeout_each))
+            os.makedirs(batch_dir, exist_ok=True)
+            zip_path = os.path.join(batch_dir, zip_name)
 
             with st.spinner(f"Processing batch {i+1}/{num_batches}"):
-                counters, events = build_zip_for_batch(
-                    batch_df, asin_col, image_columns, zip_path, timeout_each
-                )
+                args = (batch_df, asin_col, tuple(image_columns), zip_path, timeout_each, workers, url_cache)
+                counters, events = cached_batch(*args)
+                if not os.path.exists(zip_path):
+                    # The ZIP was removed from disk behind the cache's back.
+                    _cached_batch.clear(*args)
+                    counters, events = cached_batch(*args)
                 all_events.extend(events)
                 batches.append((zip_name, zip_path, counters))
 
+        prune_image_cache()
+        prune_output_dir([os.path.dirname(path) for _, path, _ in batches])
         st.session_state.batches = batches
         st.session_state.report_df = pd.DataFrame(all_events)
         st.success("All batches processed!")
@@ -194,6 +740,8 @@ if uploaded_file:
 # ------------------------------
 if st.session_state.batches:
     st.write("## Download ZIP Batches")
+    zip_paths = [path for _, path, _ in st.session_state.batches]
+    touch_dirs(zip_paths)
 
     batch_labels = [
         f"Batch {i+1}: {counters['asins']} ASINs ({zip_name})"
@@ -213,25 +761,60 @@ if st.session_state.batches:
         f"{counters['files_written']} files, {counters['errors']} errors"
     )
 
-    with open(zip_path, "rb") as f:
+    if not os.path.exists(zip_path):
+        # Left idle past BATCH_TTL, the directory was pruned by a later run.
+        st.warning("This batch has expired. Reset the app and generate it again.")
+    else:
+        # Callables are only invoked on click, so reruns don't read the ZIPs.
         st.download_button(
             "Download selected ZIP",
-            data=f,
+            data=functools.partial(read_file, zip_path),
             file_name=zip_name,
             mime="application/zip",
             key="single_download",
         )
 
+    try:
+        touch_dirs([combined_zip_path(zip_paths)])
+    except FileNotFoundError:
+        st.warning("Some batches have expired. Reset the app and generate them again to download all batches.")
+    else:
+        st.download_button(
+            "Download all batches",
+            data=functools.partial(combined_zip, zip_paths),
+            file_name="asin_batches_all.zip",
+            mime="application/zip",
+            key="all_download",
+        )
+
     st.write("## Download Report")
-    st.dataframe(st.session_state.report_df, use_container_width=True)
+    report_df = st.session_state.report_df
+
+    failures = report_df[report_df["Error"].notna()] if "Error" in report_df else report_df.iloc[:0]
+    st.write(f"**{len(failures)} failed** of {len(report_df)} images")
+    if len(failures):
+        st.dataframe(failures.head(REPORT_PREVIEW_ROWS), use_container_width=True)
+
+    # A checkbox rather than an expander: collapsed expanders still ship their
+    # contents to the browser.
+    if st.checkbox("Show full report"):
+        st.dataframe(report_df, use_container_width=True)
 
+    # Serialized on click only, not on every selectbox / checkbox rerun.
     st.download_button(
         "Download Report CSV",
-        data=st.session_state.report_df.to_csv(index=False),
+        data=functools.partial(report_df.to_csv, index=False),
         file_name="asin_image_download_report.csv",
         mime="text/csv",
     )
 
+    st.download_button(
+        "Download Report Parquet",
+        data=functools.partial(report_df.to_parquet, index=False),
+        file_name="asin_image_download_report.parquet",
+        mime="application/vnd.apache.parquet",
+    )
+
     if st.button("Reset app"):
         st.session_state.clear()
         st.experimental_rerun()
@@ -0,0 +1,327 @@
+import contextlib
+import functools
+import http.server
+import os
+import runpy
+import threading
+import time
+import zipfile
+import zlib
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("requests")
+pytest.importorskip("streamlit")
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "asin_image_downloader.py")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # The app creates its output and cache directories relative to the cwd.
+    monkeypatch.chdir(tmp_path)
+    return runpy.run_path(APP)
+
+
+@contextlib.contextmanager
+def serve(handler):
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "srv"
+    root.mkdir()
+    with serve(functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(root))) as base:
+        yield root, base
+
+
+def read_entries(path):
+    with zipfile.ZipFile(path) as zf:
+        return [(info.filename, zf.read(info)) for info in zf.infolist()]
+
+
+def test_cross_batch_reuse_with_duplicate_member_names(app, server):
+    root, base = server
+    (root / "s1.jpg").write_bytes(b"swatch one")
+    (root / "s2.jpg").write_bytes(b"swatch two")
+
+    # Two swatch columns on A1 both become "A1.Swatch.jpg" inside batch 1.
+    df = pd.DataFrame(
+        {
+            "ASIN": ["A1", "A2"],
+            "Swatch 1": [base + "s1.jpg", base + "s2.jpg"],
+            "Swatch 2": [base + "s2.jpg", base + "s1.jpg"],
+        }
+    )
+    columns = ["Swatch 1", "Swatch 2"]
+    url_cache = {}
+
+    app["build_zip_for_batch"](df.iloc[:1], "ASIN", columns, "b1.zip", 5, 4, url_cache)
+    counters, _ = app["build_zip_for_batch"](df.iloc[1:], "ASIN", columns, "b2.zip", 5, 4, url_cache)
+
+    assert counters["errors"] == 0
+    assert sorted(read_entries("b2.zip")) == [("A2.Swatch.jpg", b"swatch one"), ("A2.Swatch.jpg", b"swatch two")]
+
+
+def test_batch_zip_is_deterministic(app, server):
+    root, base = server
+    for n in range(6):
+        (root / f"{n}.jpg").write_bytes(os.urandom(1000 + n * 50000))
+
+    df = pd.DataFrame(
+        {
+            "ASIN": ["A1", "A2", "A3"],
+            "Main Image": [base + "5.jpg", base + "4.jpg", base + "3.jpg"],
+            "Image 2": [base + "2.jpg", base + "1.jpg", base + "0.jpg"],
+        }
+    )
+    columns = ["Main Image", "Image 2"]
+
+    archives = []
+    for k in range(3):
+        app["build_zip_for_batch"](df, "ASIN", columns, f"b{k}.zip", 5, 8)
+        with open(f"b{k}.zip", "rb") as f:
+            archives.append(f.read())
+
+    assert archives[0] == archives[1] == archives[2]
+    with zipfile.ZipFile("b0.zip") as zf:
+        assert zf.namelist() == [
+            "A1.Main.jpg", "A1.PT01.jpg", "A2.Main.jpg", "A2.PT01.jpg", "A3.Main.jpg", "A3.PT01.jpg",
+        ]
+
+
+def test_batches_with_errors_are_not_cached(app, server):
+    root, base = server
+    df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "m.jpg"]})
+    args = (df, "ASIN", ("Main Image",), "b.zip", 5)
+
+    counters, _ = app["cached_batch"](*args, 4, {})
+    assert counters["errors"] == 1
+
+    # The 404 was not cached, so the retry picks up the now-available image.
+    (root / "m.jpg").write_bytes(b"main")
+    counters, _ = app["cached_batch"](*args, 4, {})
+    assert counters["errors"] == 0
+
+    # A clean result is cached, and the worker count is not part of the key.
+    (root / "m.jpg").unlink()
+    counters, _ = app["cached_batch"](*args, 8, {})
+    assert counters["errors"] == 0
+
+
+def test_prune_output_dir(app):
+    out = app["OUTPUT_DIR"]
+    for name in ("old", "kept", "fresh"):
+        os.makedirs(os.path.join(out, name))
+    for name in ("old", "kept"):
+        os.utime(os.path.join(out, name), (0, 0))
+
+    app["prune_output_dir"]([os.path.join(out, "kept")])
+    assert sorted(os.listdir(out)) == ["fresh", "kept"]
+
+
+def test_combined_zip_is_merged_once(app, server):
+    root, base = server
+    (root / "m1.jpg").write_bytes(b"one")
+    (root / "m2.jpg").write_bytes(b"two")
+    df = pd.DataFrame({"ASIN": ["A1", "A2"], "Main Image": [base + "m1.jpg", base + "m2.jpg"]})
+    zip_paths = []
+    for i in range(2):
+        zip_paths.append(f"b{i}.zip")
+        app["build_zip_for_batch"](df.iloc[i : i + 1], "ASIN", ["Main Image"], zip_paths[-1], 5, 4, {})
+
+    data = app["combined_zip"](zip_paths)
+    out_path = app["combined_zip_path"](zip_paths)
+    assert read_entries(out_path) == [("A1.Main.jpg", b"one"), ("A2.Main.jpg", b"two")]
+    assert os.listdir(os.path.dirname(out_path)) == ["asin_batches_all.zip"]
+
+    # A second click serves the archive already on disk.
+    os.utime(out_path, (0, 0))
+    assert app["combined_zip"](zip_paths) == data
+    assert os.stat(out_path).st_mtime == 0
+
+
+def test_downloads_run_at_most_a_window_ahead(app, server):
+    root, base = server
+    names = [f"p{i:02d}.jpg" for i in range(30)]
+    for name in names:
+        (root / name).write_bytes(name.encode())
+
+    # Track how many downloaded bodies are open at once while the first URL is
+    # slow and everything behind it finishes.
+    glb = app["build_zip_for_batch"].__globals__
+    download, bodies, peak = glb["download_to_file"], [], [0]
+
+    def slow_first(url, *args):
+        if url.endswith(names[0]):
+            time.sleep(0.5)
+        result = download(url, *args)
+        bodies.append(result[0])
+        peak[0] = max(peak[0], sum(not b.closed for b in bodies if b is not None))
+        return result
+
+    glb["download_to_file"] = slow_first
+    df = pd.DataFrame({"ASIN": [f"A{i:02d}" for i in range(30)], "Main Image": [base + n for n in names]})
+    counters, _ = app["build_zip_for_batch"](df, "ASIN", ["Main Image"], "b.zip", 5, 2, {})
+
+    assert counters["files_written"] == 30
+    assert peak[0] <= 2 * 2 + 1
+    assert all(b.closed for b in bodies)
+
+
+def test_local_os_errors_fail_only_that_image(app, server):
+    root, base = server
+    (root / "m.jpg").write_bytes(b"main")
+    # The served body has a Last-Modified, so it is written into CACHE_DIR;
+    # pointing that at a missing directory makes NamedTemporaryFile fail.
+    app["build_zip_for_batch"].__globals__["CACHE_DIR"] = "missing"
+    df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "m.jpg"]})
+
+    counters, events = app["build_zip_for_batch"](df, "ASIN", ["Main Image"], "b.zip", 5, 4, {})
+    assert counters["errors"] == 1
+    assert events[0]["Status"] == 200
+    assert "No such file or directory" in events[0]["Error"]
+
+
+def test_combined_zip_follows_rebuilt_batches(app, server):
+    root, base = server
+    (root / "m.jpg").write_bytes(b"main")
+    df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "m.jpg"], "Other Image 1": [base + "p.jpg"]})
+    build = functools.partial(app["build_zip_for_batch"], df, "ASIN", ["Main Image", "Other Image 1"], "b.zip", 5, 4)
+
+    assert build({})[0]["errors"] == 1
+    app["combined_zip"](["b.zip"])
+
+    # The missing image appears and the batch is rebuilt at the same path.
+    (root / "p.jpg").write_bytes(b"pt")
+    assert build({})[0]["errors"] == 0
+    out = app["combined_zip_path"](["b.zip"])
+    app["combined_zip"](["b.zip"])
+    assert [name for name, _ in read_entries(out)] == ["A1.Main.jpg", "A1.PT01.jpg"]
+
+    os.remove("b.zip")
+    with pytest.raises(FileNotFoundError):
+        app["combined_zip_path"](["b.zip"])
+
+
+def test_rebuild_replaces_batch_zip_atomically(app, server):
+    root, base = server
+    (root / "m.jpg").write_bytes(b"main")
+    df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "m.jpg"]})
+    build = functools.partial(app["build_zip_for_batch"], df, "ASIN", ["Main Image"], "b.zip", 5, 4)
+    build({})
+
+    # A reader that opened the old ZIP keeps reading whole entries while the
+    # batch is rebuilt, and no temp file is left behind.
+    with zipfile.ZipFile("b.zip") as reader:
+        build({})
+        assert reader.read("A1.Main.jpg") == b"main"
+    assert not [name for name in os.listdir() if name.endswith(".tmp")]
+
+
+def test_clearing_one_batch_keeps_the_others_cached(app, server):
+    root, base = server
+    for name in ("m1.jpg", "m2.jpg"):
+        (root / name).write_bytes(name.encode())
+    df = pd.DataFrame({"ASIN": ["A1", "A2"], "Main Image": [base + "m1.jpg", base + "m2.jpg"]})
+    args = [(df.iloc[i : i + 1], "ASIN", ("Main Image",), f"c{i}.zip", 5, 4) for i in range(2)]
+    for a in args:
+        app["cached_batch"](*a, {})
+
+    (root / "m1.jpg").unlink()
+    (root / "m2.jpg").unlink()
+    app["_cached_batch"].clear(*args[0], {})
+    assert app["cached_batch"](*args[0], {})[0]["errors"] == 1
+    assert app["cached_batch"](*args[1], {})[0]["errors"] == 0
+
+
+def test_host_slots_survive_reruns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Each run_path is a fresh script run, as on every Streamlit rerun.
+    first, second = runpy.run_path(APP), runpy.run_path(APP)
+    slot = first["host_slot"]("https://m.media-amazon.com/a.jpg")
+    assert second["host_slot"]("https://M.media-amazon.com/b.jpg") is slot
+
+
+def test_unchanged_images_are_revalidated(app, server):
+    root, base = server
+    (root / "m.jpg").write_bytes(b"main")
+    df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "m.jpg"]})
+    build = functools.partial(app["build_zip_for_batch"], df, "ASIN", ["Main Image"])
+
+    _, events = build("b1.zip", 5, 4, {})
+    assert events[0]["Status"] == 200
+    # The second run sends If-Modified-Since and serves the cached body.
+    _, events = build("b2.zip", 5, 4, {})
+    assert events[0]["Status"] == 304
+    assert read_entries("b2.zip") == read_entries("b1.zip") == [("A1.Main.jpg", b"main")]
+
+
+class UnsizedHandler(http.server.BaseHTTPRequestHandler):
+    # Revalidatable body without a Content-Length, so only copy_body can
+    # notice that it is too large.
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Last-Modified", "Wed, 01 Jan 2025 00:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(b"x" * 4096)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("sized", [True, False])
+def test_oversize_bodies_leave_no_cache_files(app, server, sized):
+    root, base = server
+    (root / "big.jpg").write_bytes(b"x" * 4096)
+    app["build_zip_for_batch"].__globals__["MAX_IMAGE_BYTES"] = 1024
+
+    with contextlib.ExitStack() as stack:
+        if not sized:
+            base = stack.enter_context(serve(UnsizedHandler))
+        df = pd.DataFrame({"ASIN": ["A1"], "Main Image": [base + "big.jpg"]})
+        counters, events = app["build_zip_for_batch"](df, "ASIN", ["Main Image"], "b.zip", 5, 4, {})
+
+    assert counters["errors"] == 1
+    assert events[0]["Error"] == "too large"
+    assert os.listdir(app["CACHE_DIR"]) == ["etag_cache.sqlite"]
+
+
+def test_prune_image_cache_evicts_least_recently_used(app):
+    cache = app["CACHE_DIR"]
+    bodies = {name * 40: age for name, age in (("a", 30), ("b", 10), ("c", 20))}
+    for name, age in bodies.items():
+        path = os.path.join(cache, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(path, (age, age))
+    # In-flight temp files don't count toward the limit and are never evicted.
+    with open(os.path.join(cache, "tmpabc123"), "wb") as f:
+        f.write(b"x" * 1000)
+
+    # 300 bytes of bodies against a 200 byte limit: only the oldest (b) goes.
+    app["prune_image_cache"](200)
+    assert sorted(os.listdir(cache)) == ["a" * 40, "c" * 40, "tmpabc123"]
+
+
+def test_deflated_entries_use_deflate_level(app, tmp_path):
+    body = bytes(range(256)) * 64 + b"\0" * 8192
+    with zipfile.ZipFile("d.zip", "w") as zf:
+        with zf.open(app["zip_entry"]("A1.Main.bmp", ".bmp", len(body)), "w") as dest:
+            dest.write(body)
+
+    deflate = zlib.compressobj(app["DEFLATE_LEVEL"], zlib.DEFLATED, -15)
+    expected = len(deflate.compress(body) + deflate.flush())
+    with zipfile.ZipFile("d.zip") as zf:
+        info = zf.getinfo("A1.Main.bmp")
+        assert (info.compress_type, info.compress_size) == (zipfile.ZIP_DEFLATED, expected)